@@ -14,23 +14,32 @@ Usage:
 
 Requirements:
     python -m pip install pillow numpy requests
+    # optional, faster metadata serialization: python -m pip install orjson
+
+Metadata: one JSON object per frame, appended as a line to <output>/<basename>.ndjson
 
 Author: Claude (Anthropic) for mgua
 Date: 2025-01-17
 
-to be added: better control on output image quality, so to avoid half dark pictures
-(a possible approach could be to validate horizontal dark bands, and discard frames that do not 
-present uniform average brightness in horizontal bands)
+Half dark pictures: --max-band-std discards (and retries) frames whose horizontal bands
+do not present uniform average brightness, measured as the std of the per-row means.
 
 
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+import socket
 import time
 import sys
 import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Tuple
@@ -44,6 +53,20 @@ except ImportError:
     print("  pip install pillow numpy requests")
     sys.exit(1)
 
+# Optional: orjson for faster metadata serialization
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def json_line(obj) -> bytes:
+    """Serialize obj as one compact NDJSON line."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj) + b"\n"
+    return json.dumps(obj, separators=(',', ':')).encode() + b"\n"
+
 
 # Resolution mapping: name -> framesize value
 RESOLUTIONS = {
@@ -69,6 +92,58 @@ RESOLUTIONS = {
     "QXGA": 19,      # 2048x1564
 }
 
+# Camera controls applied by configure_camera after framesize, in this order:
+# (control var, args attribute). On/off options are sent as 1/0.
+CAMERA_CONTROLS = (
+    ("quality", "quality"),
+    ("brightness", "brightness"),
+    ("contrast", "contrast"),
+    ("saturation", "saturation"),
+    ("sharpness", "sharpness"),
+    ("denoise", "denoise"),
+    ("ae_level", "ae_level"),
+    ("gainceiling", "gainceiling"),
+    ("special_effect", "special_effect"),
+    ("awb", "awb"),
+    ("dcw", "dcw"),
+    ("awb_gain", "awb_gain"),
+    ("wb_mode", "wb_mode"),
+    ("aec", "aec"),
+    ("aec_value", "aec_value"),
+    ("aec2", "aec2"),
+    ("agc", "agc"),
+    ("agc_gain", "agc_gain"),
+    ("raw_gma", "gma"),
+    ("lenc", "lenc"),
+    ("hmirror", "hmirror"),
+    ("vflip", "vflip"),
+    ("bpc", "bpc"),
+    ("wpc", "wpc"),
+    ("colorbar", "colorbar"),
+)
+
+# Smallest size captured frames are decoded at for the brightness statistics;
+# libjpeg scales down by 1/2, 1/4 or 1/8 while decoding (FHD -> 240x135)
+STATS_SIZE = (240, 135)
+
+
+class CameraHTTPAdapter(HTTPAdapter):
+    """HTTP adapter for the one long-lived keep-alive connection to the camera.
+    
+    Keeps urllib3's default TCP_NODELAY (no Nagle delay on the small control
+    requests) and adds TCP keepalive probes, so the idle connection is not
+    silently dropped by the network during long capture intervals.
+    """
+    
+    SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ] + ([(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)]
+         if hasattr(socket, 'TCP_KEEPIDLE') else [])
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('socket_options', self.SOCKET_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
+
 
 class ESP32CamTimelapse:
     """ESP32-CAM timelapse controller with adaptive LED."""
@@ -76,21 +151,64 @@ class ESP32CamTimelapse:
     def __init__(self, args):
         self.args = args
         self.base_url = f"http://{args.host}:{args.port}"
+        self.capture_url = f"{self.base_url}/capture"
+        self._control_url = f"{self.base_url}/control"
         self.session = requests.Session()
         self.session.timeout = 15
+        # One camera, one request at a time: keep a single warm keep-alive
+        # connection instead of letting the pool grow, and fail fast on errors
+        # (capture retries are handled by capture_with_adaptive_led)
+        self.session.mount("http://", CameraHTTPAdapter(pool_connections=1, pool_maxsize=2,
+                                                         pool_block=False,
+                                                         max_retries=Retry(total=0)))
+        # Ask any cache on the way for a fresh frame, so the capture URL can
+        # stay the same on every request
+        self.session.headers.update({"Cache-Control": "no-cache", "Pragma": "no-cache"})
         
-        # Adaptive LED state
+        # Adaptive LED state; _led_preset is set when the LED was switched to
+        # current_led at the end of the interval wait, ready for the capture
         self.current_led = args.led_initial
-        self.brightness_history: list[float] = []
+        self._led_preset = False
+        # Post-capture LED-off request still running on the writer thread
+        self._pending_led_off: Optional[Future] = None
+        # Last 10 brightness values as a fixed ring buffer: slot _history_pos
+        # is written next, the first _history_len slots are valid
+        self.brightness_history = np.zeros(10, dtype=np.float64)
+        self._history_len = 0
+        self._history_pos = 0
+        # Steady state: after a run of frames close to target, only every
+        # _stats_every-th frame is measured (see update_steady_state)
+        self._stable_streak = 0
+        self._stats_every = 1
         
         # Capture state - start from specified frame number
         self.frame_number = args.start_frame
         
+        # Frames are written to disk by a background thread, overlapping the
+        # file writes with the wait for the next capture; the post-capture
+        # LED-off request runs on it too
+        self._io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="io")
+        self._pending_save: Optional[Future] = None
+        # <basename>.ndjson metadata log, opened on the first save
+        self._meta_log = None
+        
+        # When captures run back to back, the next /capture is requested while
+        # the current frame is still being analysed: (led, future) or None
+        self._capture_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._prefetch: Optional[Tuple[int, Future]] = None
+        self._next_due = 0.0
+        self._end_frame = args.start_frame + args.frames
+        
         # Setup logging
         self._setup_logging()
         
     def _setup_logging(self):
-        """Configure logging."""
+        """Configure logging.
+        
+        Records are queued and written to the console and log file by a
+        background listener thread, so a slow disk never stalls the capture
+        loop. close() stops the listener and flushes what is left.
+        """
         log_format = '%(asctime)s [%(levelname)s] %(message)s'
         
         handlers = [logging.StreamHandler(sys.stdout)]
@@ -101,18 +219,33 @@ class ESP32CamTimelapse:
             output_dir.mkdir(parents=True, exist_ok=True)
             handlers.append(logging.FileHandler(output_dir / 'capture.log'))
         
+        formatter = logging.Formatter(log_format)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        
+        log_queue = SimpleQueue()
+        self._log_listener = QueueListener(log_queue, *handlers)
+        self._log_listener.start()
+        
+        # The queue side only merges args into the message; the listener's
+        # handlers apply the real format
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.setFormatter(logging.Formatter('%(message)s'))
         logging.basicConfig(
             level=logging.DEBUG if self.args.verbose else logging.INFO,
-            format=log_format,
-            handlers=handlers
+            handlers=[queue_handler]
         )
         self.logger = logging.getLogger("ESP32Cam")
 
+    def close(self):
+        """Stop the background logger, writing out any queued records."""
+        self._log_listener.stop()
+
     def set_control(self, var: str, val) -> bool:
         """Set a camera control parameter."""
         try:
-            url = f"{self.base_url}/control?var={var}&val={val}"
-            response = self.session.get(url, timeout=5)
+            response = self.session.get(self._control_url, params=(("var", var), ("val", val)),
+                                        timeout=5)
             if response.status_code == 200:
                 self.logger.debug(f"Set {var}={val}")
                 return True
@@ -123,82 +256,87 @@ class ESP32CamTimelapse:
             self.logger.error(f"Error setting {var}: {e}")
             return False
 
+    def set_led(self, intensity: int) -> bool:
+        """Set the LED intensity, after any LED-off request still in flight.
+        
+        Waiting keeps the requests in order: a late LED-off must not land after
+        this and leave the LED dark for the next capture.
+        """
+        if self._pending_led_off is not None:
+            self._pending_led_off.result()
+            self._pending_led_off = None
+        return self.set_control("led_intensity", intensity)
+
+    def led_off_async(self):
+        """Turn the LED off from the writer thread without waiting for the reply."""
+        self._pending_led_off = self._io_pool.submit(self.set_control, "led_intensity", 0)
+
     def configure_camera(self):
         """Apply all camera settings from command line arguments."""
         self.logger.info("Configuring camera parameters...")
         
-        settings = [
-            ("framesize", RESOLUTIONS.get(self.args.resolution, 16)),
-            ("quality", self.args.quality),
-            ("brightness", self.args.brightness),
-            ("contrast", self.args.contrast),
-            ("saturation", self.args.saturation),
-            ("sharpness", self.args.sharpness),
-            ("denoise", self.args.denoise),
-            ("ae_level", self.args.ae_level),
-            ("gainceiling", self.args.gainceiling),
-            ("special_effect", self.args.special_effect),
-            ("awb", 1 if self.args.awb else 0),
-            ("dcw", 1 if self.args.dcw else 0),
-            ("awb_gain", 1 if self.args.awb_gain else 0),
-            ("wb_mode", self.args.wb_mode),
-            ("aec", 1 if self.args.aec else 0),
-            ("aec_value", self.args.aec_value),
-            ("aec2", 1 if self.args.aec2 else 0),
-            ("agc", 1 if self.args.agc else 0),
-            ("agc_gain", self.args.agc_gain),
-            ("raw_gma", 1 if self.args.gma else 0),
-            ("lenc", 1 if self.args.lenc else 0),
-            ("hmirror", 1 if self.args.hmirror else 0),
-            ("vflip", 1 if self.args.vflip else 0),
-            ("bpc", 1 if self.args.bpc else 0),
-            ("wpc", 1 if self.args.wpc else 0),
-            ("colorbar", 1 if self.args.colorbar else 0),
-        ]
+        settings = [("framesize", RESOLUTIONS.get(self.args.resolution, 16))]
+        settings += [(var, int(getattr(self.args, attr))) for var, attr in CAMERA_CONTROLS]
         
+        # Back-to-back on the session's keep-alive connection. The firmware's
+        # /control handler takes one var per request and its HTTP server runs
+        # handlers one at a time, so neither a multi-var query nor parallel
+        # requests would help; order matters too (framesize goes first).
         for var, val in settings:
             self.set_control(var, val)
-            time.sleep(0.05)  # Small delay between settings
         
         # Set initial LED
-        self.set_control("led_intensity", self.current_led)
+        self.set_led(self.current_led)
         
         self.logger.info("Camera configuration complete")
 
-    def capture_image(self) -> Tuple[Optional[Image.Image], str]:
-        """Capture a single image from the ESP32-CAM."""
+    def capture_image(self) -> Tuple[Optional[bytes], str]:
+        """Capture a single image from the ESP32-CAM.
+        
+        Returns the camera's JPEG bytes as received (None on failure) and an
+        error string. Nothing is decoded here; see compute_stats.
+        """
         try:
-            url = f"{self.base_url}/capture?_cb={int(time.time() * 1000)}"
-            response = self.session.get(url, timeout=15)
+            response = self.session.get(self.capture_url, timeout=15)
             
             if response.status_code == 200:
-                image = Image.open(BytesIO(response.content))
-                return image, ""
+                jpeg = response.content
+                if not jpeg.startswith(b"\xff\xd8"):  # JPEG start-of-image marker
+                    return None, f"Not a JPEG image ({len(jpeg)} bytes)"
+                return jpeg, ""
             else:
                 return None, f"HTTP {response.status_code}"
                 
         except requests.RequestException as e:
             return None, f"Request error: {e}"
-        except Exception as e:
-            return None, f"Image processing error: {e}"
 
-    def calculate_brightness(self, image: Image.Image) -> float:
-        """Calculate average brightness of an image."""
-        grayscale = image.convert('L')
-        np_image = np.array(grayscale)
-        return float(np.mean(np_image))
+    def compute_stats(self, jpeg: bytes) -> Tuple[float, float]:
+        """Average brightness of a JPEG and the std of its per-row means.
+        
+        The second value measures horizontal banding: it is high when part of
+        the frame is much darker than the rest (e.g. a half dark picture).
+        """
+        # Decode straight to luma at reduced scale: libjpeg's DCT scaling
+        # gives about STATS_SIZE, so convert() is a no-op unless the draft
+        # was not possible
+        image = Image.open(BytesIO(jpeg))
+        image.draft('L', STATS_SIZE)
+        small = np.asarray(image.convert('L'))
+        row_means = small.mean(axis=1, dtype=np.float32)
+        return float(row_means.mean()), float(row_means.std())
 
     def get_running_average(self) -> Optional[float]:
         """Get running average brightness."""
-        if not self.brightness_history:
+        if not self._history_len:
             return None
-        return sum(self.brightness_history) / len(self.brightness_history)
+        return float(self.brightness_history[:self._history_len].mean())
 
     def update_brightness_history(self, brightness: float):
-        """Update brightness history."""
-        self.brightness_history.append(brightness)
-        if len(self.brightness_history) > 10:
-            self.brightness_history.pop(0)
+        """Update brightness history, overwriting the oldest value once full."""
+        size = self.brightness_history.size
+        self.brightness_history[self._history_pos] = brightness
+        self._history_pos = (self._history_pos + 1) % size
+        self._history_len = min(size, self._history_len + 1)
 
     def is_consistent(self, brightness: float) -> bool:
         """Check if brightness is consistent with history."""
@@ -219,26 +357,73 @@ class ESP32CamTimelapse:
         adjustment = max(-20, min(20, adjustment))
         return adjustment
 
-    def capture_with_adaptive_led(self) -> Tuple[Optional[Image.Image], float, int]:
-        """Capture image with adaptive LED control and consistency checking."""
+    def update_steady_state(self, brightness: float):
+        """Measure only every 4th frame once brightness has stayed near target.
+        
+        More than 5 measured frames in a row within half the brightness
+        tolerance count as steady; any frame outside it (which includes every
+        frame that needs an LED adjustment) returns to measuring every frame.
+        The band check needs every frame measured, so it disables this.
+        """
+        if (not self.args.max_band_std
+                and abs(brightness - self.args.target_brightness) <= self.args.brightness_tolerance / 2):
+            self._stable_streak += 1
+        else:
+            self._stable_streak = 0
+        self._stats_every = 4 if self._stable_streak > 5 else 1
+
+    def capture_with_adaptive_led(self) -> Tuple[Optional[bytes], Optional[float], int]:
+        """Capture image with adaptive LED control and consistency checking.
+        
+        Returns the accepted frame's JPEG bytes (None on failure), its
+        brightness (None if it was not measured, in steady state) and the LED
+        intensity used.
+        """
         for attempt in range(self.args.max_retries):
-            # Set LED before capture
-            self.set_control("led_intensity", self.current_led)
-            time.sleep(0.2)
-            
-            # Capture
-            image, error = self.capture_image()
-            
-            # Turn off LED after capture
-            if not self.args.led_always_on:
-                self.set_control("led_intensity", 0)
+            jpeg, error = self._take_prefetched()
+            if jpeg is None and not error:
+                if self._led_preset:
+                    # Already set and settled during the interval wait
+                    self._led_preset = False
+                else:
+                    # Set LED before capture. The firmware's /capture handler itself
+                    # switches the LED on at this intensity ~150ms before grabbing
+                    # the frame, so only a short settle is needed here.
+                    self.set_led(self.current_led)
+                    if self.args.led_settle_ms > 0:
+                        time.sleep(self.args.led_settle_ms / 1000)
+                
+                # Capture
+                jpeg, error = self.capture_image()
+                
+                # Turn off LED after capture, without waiting for the reply
+                if not self.args.led_always_on:
+                    self.led_off_async()
             
-            if image is None:
+            if jpeg is None:
                 self.logger.warning(f"Capture attempt {attempt+1} failed: {error}")
                 time.sleep(1)
                 continue
             
-            brightness = self.calculate_brightness(image)
+            self._start_prefetch()
+            
+            # Steady state: no decode or checks, the LED is left as it is
+            if self.frame_number % self._stats_every:
+                return jpeg, None, self.current_led
+            
+            try:
+                brightness, band_std = self.compute_stats(jpeg)
+            except Exception as e:
+                self.logger.warning(f"Capture attempt {attempt+1} failed: Image processing error: {e}")
+                continue
+            self.logger.debug(f"Brightness {brightness:.1f}, band std {band_std:.1f}")
+            
+            # Reject frames with non-uniform horizontal bands
+            if self.args.max_band_std and band_std > self.args.max_band_std:
+                self.logger.warning(
+                    f"Non-uniform bands (std {band_std:.1f} > {self.args.max_band_std}), retrying..."
+                )
+                continue
             
             # Check consistency
             if not self.is_consistent(brightness):
@@ -246,48 +431,113 @@ class ESP32CamTimelapse:
                 self.logger.warning(
                     f"Inconsistent brightness {brightness:.1f} vs avg {avg:.1f}, retrying..."
                 )
-                time.sleep(0.5)
+                # No pause: the next /capture grabs a fresh frame anyway
                 continue
             
-            return image, brightness, self.current_led
+            return jpeg, brightness, self.current_led
         
         return None, 0.0, self.current_led
 
-    def generate_filename(self) -> str:
+    def _start_prefetch(self):
+        """Request the next frame now if it will be wanted straight away.
+        
+        Only when the LED stays on (no off/on control calls between captures),
+        more frames remain and the next one is already due, i.e. the interval
+        is shorter than a capture cycle.
+        """
+        if (self._prefetch is None and self.args.led_always_on
+                and self.frame_number + 1 < self._end_frame
+                and time.time() >= self._next_due):
+            self._prefetch = (self.current_led, self._capture_pool.submit(self.capture_image))
+
+    def _take_prefetched(self) -> Tuple[Optional[bytes], str]:
+        """Result of the prefetched capture, or (None, "") if there is none.
+        
+        A prefetch taken before an LED adjustment is waited for and dropped.
+        """
+        if self._prefetch is None:
+            return None, ""
+        led, future = self._prefetch
+        self._prefetch = None
+        result = future.result()
+        if led != self.current_led:
+            return None, ""
+        return result
+
+    def wait_for_next_capture(self, wait_time: float):
+        """Sleep until the next capture, setting the LED for it at the end.
+        
+        The LED control call and its settle time then overlap the wait instead
+        of delaying the capture.
+        """
+        settle = self.args.led_settle_ms / 1000
+        deadline = time.time() + wait_time
+        if wait_time > settle:
+            time.sleep(wait_time - settle)
+            self._led_preset = self.set_led(self.current_led)
+        time.sleep(max(0.0, deadline - time.time()))
+
+    def generate_filename(self, frame_number: Optional[int] = None) -> str:
         """Generate filename with 5-digit frame number."""
-        return f"{self.args.basename}_{self.frame_number:05d}.jpg"
+        if frame_number is None:
+            frame_number = self.frame_number
+        return f"{self.args.basename}_{frame_number:05d}.jpg"
 
-    def save_image(self, image: Image.Image, brightness: float, led: int) -> str:
-        """Save image and metadata."""
+    def save_image(self, jpeg: bytes, metadata: dict) -> str:
+        """Save image and metadata for the frame numbered in metadata['frame']."""
         output_dir = Path(self.args.output)
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        filename = self.generate_filename()
+        frame_number = metadata['frame']
+        filename = self.generate_filename(frame_number)
         filepath = output_dir / filename
         
-        # Save image
-        image.save(filepath, "JPEG", quality=95)
+        # Save the camera's JPEG as is: no decode/re-encode round trip
+        filepath.write_bytes(jpeg)
         
-        # Save metadata
+        # Append metadata to the log; flushed per frame so an interrupted
+        # capture keeps every saved frame's line
         if self.args.save_metadata:
-            metadata = {
-                'frame': self.frame_number,
-                'timestamp': datetime.now().isoformat(),
-                'brightness': brightness,
-                'led_intensity': led,
-                'running_avg': self.get_running_average(),
-            }
-            meta_path = output_dir / f"{self.args.basename}_{self.frame_number:05d}.json"
-            with open(meta_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            if self._meta_log is None:
+                self._meta_log = open(output_dir / f"{self.args.basename}.ndjson", 'ab')
+            self._meta_log.write(json_line(metadata))
+            self._meta_log.flush()
         
         return str(filepath)
 
+    def queue_save(self, jpeg: bytes, brightness: Optional[float], led: int) -> str:
+        """Save the current frame on the background writer; returns its path.
+        
+        Metadata is taken now, on the capture thread, so it reflects this frame.
+        At most one save is outstanding: a new one waits for the previous write.
+        """
+        metadata = {
+            'frame': self.frame_number,
+            'timestamp': datetime.now().isoformat(),
+            'brightness': brightness,
+            'led_intensity': led,
+            'running_avg': self.get_running_average(),
+        }
+        self.wait_for_save()
+        self._pending_save = self._io_pool.submit(self.save_image, jpeg, metadata)
+        self._pending_save.add_done_callback(self._log_save_error)
+        return str(Path(self.args.output) / self.generate_filename())
+
+    def _log_save_error(self, future: Future):
+        if future.exception() is not None:
+            self.logger.error(f"Failed to save frame: {future.exception()}")
+
+    def wait_for_save(self):
+        """Block until the outstanding background save (if any) has finished."""
+        if self._pending_save is not None:
+            self._pending_save.exception()  # waits; errors are logged by the callback
+            self._pending_save = None
+
     def test_connection(self) -> bool:
         """Test connection to ESP32-CAM."""
         self.logger.info(f"Testing connection to {self.args.host}...")
         try:
-            response = requests.get(f"{self.base_url}/status", timeout=5)
+            response = self.session.get(f"{self.base_url}/status", timeout=5)
             if response.status_code == 200:
                 self.logger.info("Connection successful!")
                 return True
@@ -315,6 +565,8 @@ class ESP32CamTimelapse:
         start_frame = self.args.start_frame
         frames_to_capture = self.args.frames
         end_frame = start_frame + frames_to_capture
+        # Prefetching stops at the last frame (args may change after __init__, e.g. --test)
+        self._end_frame = end_frame
         
         self.logger.info(f"Starting timelapse: {frames_to_capture} frames, {self.args.interval}s interval")
         self.logger.info(f"Frame range: {start_frame:05d} to {end_frame - 1:05d}")
@@ -325,32 +577,38 @@ class ESP32CamTimelapse:
         try:
             while self.frame_number < end_frame:
                 cycle_start = time.time()
+                self._next_due = cycle_start + self.args.interval
                 
                 progress = self.frame_number - start_frame + 1
                 self.logger.info(f"--- Frame {self.frame_number:05d} ({progress}/{frames_to_capture}) ---")
                 
                 # Capture with adaptive LED
-                image, brightness, led = self.capture_with_adaptive_led()
+                jpeg, brightness, led = self.capture_with_adaptive_led()
                 
-                if image is None:
+                if jpeg is None:
                     self.logger.error("Capture failed after retries, skipping frame")
                     self.frame_number += 1
                     time.sleep(self.args.interval)
                     continue
                 
-                # Save
-                filepath = self.save_image(image, brightness, led)
-                self.logger.info(f"Saved: {filepath} (brightness: {brightness:.1f}, LED: {led})")
-                
-                # Update history
-                self.update_brightness_history(brightness)
-                
-                # Adjust LED for next frame
-                adjustment = self.calculate_led_adjustment(brightness)
-                if adjustment != 0:
-                    new_led = max(0, min(255, self.current_led + adjustment))
-                    self.logger.info(f"LED adjustment: {self.current_led} -> {new_led}")
-                    self.current_led = new_led
+                # Save (in the background)
+                filepath = self.queue_save(jpeg, brightness, led)
+                if brightness is None:
+                    self.logger.info(f"Saving: {filepath} (brightness: not measured, LED: {led})")
+                else:
+                    self.logger.info(f"Saving: {filepath} (brightness: {brightness:.1f}, LED: {led})")
+                    
+                    # Update history
+                    self.update_brightness_history(brightness)
+                    
+                    # Adjust LED for next frame
+                    adjustment = self.calculate_led_adjustment(brightness)
+                    if adjustment != 0:
+                        new_led = max(0, min(255, self.current_led + adjustment))
+                        self.logger.info(f"LED adjustment: {self.current_led} -> {new_led}")
+                        self.current_led = new_led
+                    
+                    self.update_steady_state(brightness)
                 
                 self.frame_number += 1
                 captured_count += 1
@@ -361,10 +619,16 @@ class ESP32CamTimelapse:
                     wait_time = max(0, self.args.interval - elapsed)
                     if wait_time > 0:
                         self.logger.info(f"Next capture in {wait_time:.0f}s")
-                        time.sleep(wait_time)
+                        self.wait_for_next_capture(wait_time)
                         
         except KeyboardInterrupt:
             self.logger.info("Interrupted by user")
+        finally:
+            # Drop any unused prefetch and flush the last frame to disk
+            self._capture_pool.shutdown(wait=True)
+            self._io_pool.shutdown(wait=True)
+            if self._meta_log is not None:
+                self._meta_log.close()
         
         self.logger.info(f"Timelapse complete: {captured_count} frames captured (last frame: {self.frame_number - 1:05d})")
         return True
@@ -396,7 +660,7 @@ def main():
     capture.add_argument('--basename', '-b', default='frame',
                          help='Base filename (frame number appended as 5 digits)')
     capture.add_argument('--save-metadata', action='store_true', default=True,
-                         help='Save JSON metadata alongside images')
+                         help='Append per-frame JSON metadata to <basename>.ndjson')
     capture.add_argument('--no-metadata', dest='save_metadata', action='store_false',
                          help='Do not save JSON metadata')
     
@@ -483,12 +747,18 @@ def main():
                      help='Initial LED intensity (0-255)')
     led.add_argument('--led-always-on', action='store_true', default=False,
                      help='Keep LED on between captures')
+    led.add_argument('--led-settle-ms', type=int, default=50,
+                     help='Delay after setting the LED before capturing (ms); the firmware '
+                          'already lights the LED ~150ms before each capture')
     led.add_argument('--target-brightness', type=int, default=128,
                      help='Target image brightness (0-255)')
     led.add_argument('--brightness-tolerance', type=int, default=30,
                      help='Acceptable brightness deviation from target')
     led.add_argument('--consistency-tolerance', type=int, default=40,
                      help='Max deviation from running average before retry')
+    led.add_argument('--max-band-std', type=float, default=0,
+                     help='Retry frames whose per-row mean brightness varies by more than '
+                          'this std (catches half dark pictures); 0 disables the check')
     led.add_argument('--max-retries', type=int, default=3,
                      help='Max capture retries per frame')
     
@@ -503,17 +773,20 @@ def main():
     # Create controller
     controller = ESP32CamTimelapse(args)
     
-    if args.test:
-        # Test mode
-        if controller.test_connection():
-            controller.configure_camera()
-            time.sleep(1)
-            controller.args.frames = 1
-            controller.run()
-        sys.exit(0)
-    
-    # Run timelapse
-    controller.run()
+    try:
+        if args.test:
+            # Test mode
+            if controller.test_connection():
+                controller.configure_camera()
+                time.sleep(1)
+                controller.args.frames = 1
+                controller.run()
+            sys.exit(0)
+        
+        # Run timelapse
+        controller.run()
+    finally:
+        controller.close()
 
 
 if __name__ == "__main__":